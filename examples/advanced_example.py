@@ -9,25 +9,32 @@ This script shows more complex scenarios including:
 - Data processing errors
 """
 
-import json
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from self_debug_cli import self_debug
 
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
 
 @self_debug
 def fetch_user_data(user_id):
     """Fetch user data from an API - will fail with connection error."""
     # Simulate API call to non-existent endpoint
-    response = requests.get(f"https://api.example.com/users/{user_id}", timeout=5)
-    response.raise_for_status()
-    return response.json()
+    with requests.get(f"https://api.example.com/users/{user_id}", timeout=5, stream=True) as response:
+        # The status is known before the body is downloaded, so error pages are never read
+        response.raise_for_status()
+        # Parse the raw bytes directly instead of decoding them to text first
+        return _json.loads(response.content)
 
 
 @self_debug
 def process_json_data(json_string):
     """Process JSON data - will fail with malformed JSON."""
-    data = json.loads(json_string)
+    data = _json.loads(json_string)
     return data["name"]
 
 
@@ -85,60 +92,33 @@ def main():
     print("🚀 Self-Debugging CLI Tool - Advanced Example")
     print("=" * 55)
     
-    # Example 1: API call failure
-    print("\n1. Testing API call failure...")
-    try:
-        result = fetch_user_data(123)
-        print(f"User data: {result}")
-    except Exception as e:
-        print(f"API call failed: {e}")
-    
-    # Example 2: JSON parsing error
-    print("\n2. Testing JSON parsing error...")
-    try:
-        malformed_json = '{"name": "John", "age": 30,}'  # Trailing comma
-        result = process_json_data(malformed_json)
-        print(f"Processed data: {result}")
-    except Exception as e:
-        print(f"JSON processing failed: {e}")
-    
-    # Example 3: Statistics calculation with empty data
-    print("\n3. Testing statistics calculation...")
-    try:
-        result = calculate_statistics([])
-        print(f"Statistics: {result}")
-    except Exception as e:
-        print(f"Statistics calculation failed: {e}")
-    
-    # Example 4: Configuration validation
-    print("\n4. Testing configuration validation...")
-    try:
-        invalid_config = {
-            "api_key": "",  # Empty API key
-            "base_url": "https://api.example.com"
-            # Missing timeout field
-        }
-        result = validate_config(invalid_config)
-        print(f"Config validation: {result}")
-    except Exception as e:
-        print(f"Config validation failed: {e}")
+    malformed_json = '{"name": "John", "age": 30,}'  # Trailing comma
+    invalid_config = {
+        "api_key": "",  # Empty API key
+        "base_url": "https://api.example.com"
+        # Missing timeout field
+    }
+    connection_params = {"host": "invalid_host", "port": 5432}
     
-    # Example 5: Date formatting error
-    print("\n5. Testing date formatting...")
-    try:
-        result = format_date("2023-13-45")  # Invalid date
-        print(f"Formatted date: {result}")
-    except Exception as e:
-        print(f"Date formatting failed: {e}")
+    scenarios = [
+        ("1. API call", fetch_user_data, (123,)),
+        ("2. JSON parsing", process_json_data, (malformed_json,)),
+        ("3. Statistics calculation", calculate_statistics, ([],)),
+        ("4. Configuration validation", validate_config, (invalid_config,)),
+        ("5. Date formatting", format_date, ("2023-13-45",)),  # Invalid date
+        ("6. Database connection", database_query, ("SELECT * FROM users", connection_params)),
+    ]
     
-    # Example 6: Database connection error
-    print("\n6. Testing database connection...")
-    try:
-        connection_params = {"host": "invalid_host", "port": 5432}
-        result = database_query("SELECT * FROM users", connection_params)
-        print(f"Database result: {result}")
-    except Exception as e:
-        print(f"Database query failed: {e}")
+    # The scenarios are independent, so run them concurrently to overlap network waits
+    print("\nRunning all scenarios concurrently...")
+    with ThreadPoolExecutor(max_workers=len(scenarios)) as executor:
+        futures = {executor.submit(fn, *args): name for name, fn, args in scenarios}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                print(f"\n{name} result: {future.result()}")
+            except Exception as e:
+                print(f"\n{name} failed: {e}")
     
     print("\n✅ All advanced examples completed!")
 
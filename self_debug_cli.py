@@ -10,47 +10,416 @@ import os
 import sys
 import traceback
 import inspect
+import ast
+import textwrap
+import linecache
 import json
-from typing import Any, Callable, Optional, Dict, List
-from functools import wraps
+import re
+import runpy
+import hashlib
+import getpass
+import platform
+import tempfile
+import importlib.util
+import atexit
+import threading
+import types
+from typing import Any, Callable, Optional, Dict, List, Tuple
+from functools import wraps, lru_cache
 from pathlib import Path
 
-import click
-from rich.console import Console
-from rich.panel import Panel
-from rich.syntax import Syntax
-from rich.text import Text
-from rich.prompt import Confirm
-from dotenv import load_dotenv
-
+# Use the faster orjson parser when it is installed
 try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
+    from orjson import loads as _json_loads
 except ImportError:
-    OPENAI_AVAILABLE = False
+    from json import loads as _json_loads
+
+# openai, rich and click are imported where they are first needed, since
+# together they dominate import time for scripts that never hit an error
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
+
+# Load environment variables, searching upward from this file like load_dotenv()
+# does, so that python-dotenv is only imported when there is a .env file to read
+_DOTENV_PATH = next(
+    (path / ".env" for path in Path(__file__).resolve().parents if (path / ".env").is_file()),
+    None
+)
+if _DOTENV_PATH:
+    from dotenv import load_dotenv
+    load_dotenv(_DOTENV_PATH, override=False)
+
+# Read the environment once rather than on every SelfDebugCLI instantiation
+_DEFAULT_API_KEY = os.environ.get("OPENAI_API_KEY")
+_DEFAULT_DEBUG_MODE = os.environ.get("SELF_DEBUG_MODE", "true").lower() == "true"
+
+_console = None
+
+
+def _get_console():
+    """Return the shared rich console, creating it on first use."""
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
+
+
+@lru_cache(maxsize=256)
+def _highlight(code: str) -> Any:
+    """
+    Syntax-highlight a code snippet once and reuse the result.
+    
+    rich.syntax.Syntax re-runs the Pygments lexer every time it is rendered, so
+    the highlighted Text is cached instead of the Syntax object.
+    """
+    from rich.syntax import Syntax
+    text = Syntax(code, "python", theme="monokai").highlight(code)
+    text.rstrip()
+    return text
+
+
+@lru_cache(maxsize=1)
+def _library_dirs() -> Tuple[str, ...]:
+    """Return the directories holding the standard library and installed packages."""
+    import sysconfig
+    
+    paths = sysconfig.get_paths()
+    dirs = {os.path.realpath(paths[name]) for name in ("stdlib", "platstdlib", "purelib", "platlib")
+            if name in paths}
+    return tuple(os.path.join(d, "") for d in dirs)
+
+
+def _is_library_file(filename: str) -> bool:
+    """Whether a traceback filename belongs to this module, the stdlib or an installed package."""
+    # Frozen and generated code, e.g. <frozen importlib._bootstrap> or <string>
+    if filename.startswith("<"):
+        return True
+    path = os.path.realpath(filename)
+    if path == os.path.realpath(__file__) or "site-packages" in path.split(os.sep):
+        return True
+    return path.startswith(_library_dirs())
+
+
+# On-disk cache of previous analyses, keyed by error type and normalized traceback
+CACHE_PATH = Path.home() / ".cache" / "self_debug_cli" / "analysis.json"
+
+# Placeholder used when no source code can be found
+SOURCE_UNAVAILABLE = "Source code not available"
+
+# Lines of context shown around the failing line when the function source is unknown
+SOURCE_CONTEXT_LINES = 10
+
+# Errors analyzed per batched request, and the answer tokens allowed for each
+BATCH_SIZE = 4
+BATCH_TOKENS_PER_ERROR = 500
+
+# Parts of a traceback that change between runs without changing the error:
+# the location prefix of each frame line, and memory addresses in reprs
+_PATH_NORM_RE = re.compile(r'^\s*File "[^"]+", line \d+', re.MULTILINE)
+_HEX_RE = re.compile(r'0x[0-9a-fA-F]+')
+
+# Static start of every single-error prompt. Keeping the instructions and the
+# response format first gives all requests an identical prefix, which OpenAI's
+# automatic prompt caching can reuse.
+_PROMPT_PREFIX = """
+Please analyze this Python error and provide a detailed explanation and fix.
+
+Please provide your analysis in the following JSON format:
+{
+    "explanation": "Clear explanation of what went wrong",
+    "root_cause": "The underlying cause of the error",
+    "suggested_fix": "Specific code fix or workaround",
+    "confidence": "high/medium/low",
+    "additional_notes": "Any additional helpful information"
+}
+"""
 
-# Load environment variables
-load_dotenv()
+# Static start of the prompt for analyzing several queued errors at once
+_BATCH_PROMPT_PREFIX = """
+Please analyze these Python errors and provide a detailed explanation and fix for each one.
+
+Please provide your analysis in the following JSON format, with one entry in
+"analyses" per error, in the same order as the errors below:
+{
+    "analyses": [
+        {
+            "explanation": "Clear explanation of what went wrong",
+            "root_cause": "The underlying cause of the error",
+            "suggested_fix": "Specific code fix or workaround",
+            "confidence": "high/medium/low",
+            "additional_notes": "Any additional helpful information"
+        }
+    ]
+}
+"""
+
+def _prompt_cache_user() -> str:
+    """Return a stable, anonymous identifier for this machine and user."""
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = ""
+    return hashlib.blake2b(f"{user}@{platform.node()}".encode(), digest_size=16).hexdigest()
+
+
+class LocalAnalyzer:
+    """
+    Rules engine that explains common errors without calling GPT-4.
+    
+    Each rule looks at the AST of the failing function and only answers with
+    high confidence when exactly one expression can have raised the error.
+    """
+    
+    def analyze(self, error: Exception, func: Callable, args: tuple,
+                kwargs: dict) -> Optional[Dict[str, Any]]:
+        """Return an analysis in the GPT-4 response format, or None if no rule applies."""
+        if isinstance(error, json.JSONDecodeError):
+            return self._analyze_json_error(error)
+        
+        rule = {
+            ZeroDivisionError: self._analyze_zero_division,
+            IndexError: self._analyze_index_error,
+            KeyError: self._analyze_key_error,
+        }.get(type(error))
+        if rule is None or not hasattr(ast, "get_source_segment"):
+            return None
+        
+        source = self._function_source(func)
+        if source is None:
+            return None
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            return None
+        
+        nodes = self._nodes_at_error(tree, func, error)
+        return rule(error, source, tree, nodes)
+    
+    def _function_source(self, func: Callable) -> Optional[str]:
+        """Return the dedented source of the function itself, not a traceback excerpt."""
+        source = getattr(func, "_cached_source", None)
+        if not source or source == SOURCE_UNAVAILABLE:
+            try:
+                source = inspect.getsource(inspect.unwrap(func))
+            except (OSError, TypeError, ValueError):
+                return None
+        return textwrap.dedent(source)
+    
+    def _nodes_at_error(self, tree: ast.AST, func: Callable, error: Exception) -> List[ast.AST]:
+        """Return the AST nodes on the line that raised, or every node if it is unknown."""
+        nodes = list(ast.walk(tree))
+        code = getattr(inspect.unwrap(func), "__code__", None)
+        if code is None:
+            return nodes
+        
+        lineno = None
+        tb = error.__traceback__
+        while tb is not None:
+            if tb.tb_frame.f_code is code:
+                lineno = tb.tb_lineno
+            tb = tb.tb_next
+        if lineno is None:
+            return nodes
+        
+        # The source starts at co_firstlineno, which includes any decorators
+        relative = lineno - code.co_firstlineno + 1
+        on_line = [
+            node for node in nodes
+            if getattr(node, "lineno", None) is not None
+            and node.lineno <= relative <= (node.end_lineno or node.lineno)
+        ]
+        return on_line or nodes
+    
+    def _with_guard(self, source: str, tree: ast.AST, node: ast.AST, guard: List[str]) -> str:
+        """Return the function source with guard lines inserted before the statement holding node."""
+        statements = [
+            stmt for stmt in ast.walk(tree)
+            if isinstance(stmt, ast.stmt)
+            and not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and stmt.lineno <= node.lineno <= (stmt.end_lineno or stmt.lineno)
+        ]
+        if not statements:
+            return "\n".join(guard)
+        
+        statement = max(statements, key=lambda stmt: stmt.lineno)
+        lines = source.splitlines()
+        line = lines[statement.lineno - 1]
+        indent = line[:len(line) - len(line.lstrip())]
+        lines[statement.lineno - 1:statement.lineno - 1] = [indent + guard_line for guard_line in guard]
+        return "\n".join(lines)
+    
+    def _analyze_zero_division(self, error: Exception, source: str, tree: ast.AST,
+                               nodes: List[ast.AST]) -> Optional[Dict[str, Any]]:
+        """Explain a division, floor division or modulo by zero."""
+        division_ops = (ast.Div, ast.FloorDiv, ast.Mod)
+        candidates = [
+            node for node in nodes
+            if isinstance(node, (ast.BinOp, ast.AugAssign)) and isinstance(node.op, division_ops)
+        ]
+        if len(candidates) != 1:
+            return None
+        
+        node = candidates[0]
+        divisor = ast.get_source_segment(source, node.right if isinstance(node, ast.BinOp) else node.value)
+        expression = ast.get_source_segment(source, node)
+        return {
+            "explanation": f"`{expression}` divides by `{divisor}`, which was zero.",
+            "root_cause": f"`{divisor}` is 0 and nothing checks for that before dividing.",
+            "suggested_fix": self._with_guard(source, tree, node, [
+                f"if {divisor} == 0:",
+                f"    raise ValueError({f'{divisor} must not be zero'!r})",
+            ]),
+            "confidence": "high",
+            "additional_notes": "Depending on the caller, returning a default value instead of raising may be more appropriate."
+        }
+    
+    def _analyze_index_error(self, error: Exception, source: str, tree: ast.AST,
+                             nodes: List[ast.AST]) -> Optional[Dict[str, Any]]:
+        """Explain an out-of-range sequence index."""
+        candidates = [
+            node for node in nodes
+            if isinstance(node, ast.Subscript) and isinstance(node.ctx, ast.Load)
+            and not isinstance(node.slice, ast.Slice)
+        ]
+        if len(candidates) != 1:
+            return None
+        
+        node = candidates[0]
+        sequence = ast.get_source_segment(source, node.value)
+        index = ast.get_source_segment(source, node.slice)
+        if index is None:
+            return None
+        return {
+            "explanation": f"`{sequence}[{index}]` uses an index outside the bounds of `{sequence}`.",
+            "root_cause": f"`{index}` is not between -len({sequence}) and len({sequence}) - 1.",
+            "suggested_fix": self._with_guard(source, tree, node, [
+                f"if not -len({sequence}) <= {index} < len({sequence}):",
+                f"    raise ValueError({f'{index} is out of range for {sequence}'!r})",
+            ]),
+            "confidence": "high",
+            "additional_notes": "Remember that indexes start at 0, so the last valid index is len(sequence) - 1."
+        }
+    
+    def _analyze_key_error(self, error: Exception, source: str, tree: ast.AST,
+                           nodes: List[ast.AST]) -> Optional[Dict[str, Any]]:
+        """Explain a missing dictionary key."""
+        # A KeyError raised on purpose is about the caller's input, not this code
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Raise) and "KeyError" in (ast.get_source_segment(source, node) or ""):
+                return None
+        
+        candidates = [
+            node for node in nodes
+            if isinstance(node, ast.Subscript) and isinstance(node.ctx, ast.Load)
+            and not isinstance(node.slice, ast.Slice)
+        ]
+        if len(candidates) != 1:
+            return None
+        
+        node = candidates[0]
+        mapping = ast.get_source_segment(source, node.value)
+        key = ast.get_source_segment(source, node.slice)
+        if key is None:
+            return None
+        return {
+            "explanation": f"`{mapping}` has no entry for the key {error}.",
+            "root_cause": f"`{mapping}[{key}]` assumes the key is always present.",
+            "suggested_fix": self._with_guard(source, tree, node, [
+                f"if {key} not in {mapping}:",
+                f"    raise ValueError({f'{mapping} is missing the key {key}'!r})",
+            ]),
+            "confidence": "high",
+            "additional_notes": f"If the key is optional, use `{mapping}.get({key})` to get None instead."
+        }
+    
+    def _analyze_json_error(self, error: json.JSONDecodeError) -> Optional[Dict[str, Any]]:
+        """Explain JSON that fails to parse because of a trailing comma."""
+        document = getattr(error, "doc", None)
+        if not isinstance(document, str):
+            return None
+        
+        # Only blame a comma the parser actually stopped at, and only answer
+        # once removing such commas leaves JSON that parses
+        fixed, pos = document, error.pos
+        while True:
+            comma = self._trailing_comma(fixed, pos)
+            if comma is None:
+                return None
+            fixed = fixed[:comma] + fixed[comma + 1:]
+            try:
+                json.loads(fixed)
+                break
+            except json.JSONDecodeError as e:
+                pos = e.pos
+        
+        return {
+            "explanation": "The JSON input has a comma right before a closing bracket, which JSON does not allow.",
+            "root_cause": "A trailing comma after the last item of an object or array.",
+            "suggested_fix": f"# Valid JSON without the trailing comma\n{fixed!r}",
+            "confidence": "high",
+            "additional_notes": "Python literals accept trailing commas, but JSON parsers reject them."
+        }
+    
+    def _trailing_comma(self, document: str, pos: int) -> Optional[int]:
+        """Return the index of the comma before the closing bracket at pos, if there is one."""
+        if not 0 <= pos < len(document) or document[pos] not in "}]":
+            return None
+        comma = pos - 1
+        while comma >= 0 and document[comma] in " \t\r\n":
+            comma -= 1
+        return comma if comma >= 0 and document[comma] == "," else None
 
-console = Console()
 
 class SelfDebugCLI:
     """Main class for the self-debugging CLI tool."""
     
     def __init__(self, api_key: Optional[str] = None):
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        self.client = None
-        self.debug_mode = os.getenv("SELF_DEBUG_MODE", "true").lower() == "true"
+        self.api_key = api_key or _DEFAULT_API_KEY
+        self._client = None
+        self._client_initialized = False
+        self._client_lock = threading.Lock()
+        self.debug_mode = _DEFAULT_DEBUG_MODE
+        self.use_cache = True
+        self.capture_locals = False
+        self.buffered_mode = False
+        self._pending: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_registered = False
+        # Only one error at a time may render its analysis and prompt the user
+        self._handle_lock = threading.RLock()
+        self._cache: Optional[Dict[str, Dict[str, Any]]] = None
+        self._cache_lock = threading.Lock()
+        self._global_hook_installed = False
+        # The script run by the CLI; tracebacks show its code rather than ours
+        self.script_path: Optional[str] = None
+        self._local = LocalAnalyzer()
+        self._prompt_cache_user = _prompt_cache_user()
         
-        if OPENAI_AVAILABLE and self.api_key:
-            try:
-                self.client = OpenAI(api_key=self.api_key)
-            except Exception as e:
-                console.print(f"[red]Warning: Failed to initialize OpenAI client: {e}[/red]")
-        elif not OPENAI_AVAILABLE:
-            console.print("[yellow]Warning: OpenAI package not installed. Install with: pip install openai[/yellow]")
+        if not OPENAI_AVAILABLE:
+            _get_console().print("[yellow]Warning: OpenAI package not installed. Install with: pip install openai[/yellow]")
         elif not self.api_key:
-            console.print("[yellow]Warning: OPENAI_API_KEY not set. Set it in your environment or .env file[/yellow]")
+            _get_console().print("[yellow]Warning: OPENAI_API_KEY not set. Set it in your environment or .env file[/yellow]")
+    
+    @property
+    def client(self) -> Optional[Any]:
+        """The OpenAI client, created on first use so openai is only imported when needed."""
+        if not self._client_initialized:
+            # Functions running on several threads may fail at the same time
+            with self._client_lock:
+                if not self._client_initialized:
+                    if OPENAI_AVAILABLE and self.api_key:
+                        try:
+                            from openai import OpenAI
+                            self._client = OpenAI(api_key=self.api_key)
+                        except Exception as e:
+                            _get_console().print(f"[red]Warning: Failed to initialize OpenAI client: {e}[/red]")
+                    self._client_initialized = True
+        return self._client
+    
+    @client.setter
+    def client(self, value: Optional[Any]):
+        self._client = value
+        self._client_initialized = True
     
     def debug_function(self, func: Callable) -> Callable:
         """
@@ -61,49 +430,361 @@ class SelfDebugCLI:
             
         Returns:
             Wrapped function with error handling
+        
+        Note:
+            Functions decorated while debugging is disabled, or while there is
+            neither an API key nor an assigned client, are returned unchanged, so
+            enabling debugging later requires decorating them again. Use install_global_hook() to toggle debugging at runtime.
         """
+        # Nothing can be analyzed, so avoid the extra wrapper frame on every call
+        can_analyze = self._client is not None or (OPENAI_AVAILABLE and self.api_key)
+        if not self.debug_mode or not can_analyze:
+            return func
+        
+        # Uncaught errors are already handled by the global hook, so skip the wrapper frame
+        if self._global_hook_installed:
+            return func
+        
+        # Read the source once at decoration time so the error path never touches disk
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = SOURCE_UNAVAILABLE
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
             try:
                 return func(*args, **kwargs)
             except Exception as e:
                 if self.debug_mode and self.client:
-                    self._handle_error(e, func, args, kwargs)
+                    self._handle_error(e, wrapper, args, kwargs, sys.exc_info())
                 else:
                     # Re-raise the exception if debugging is disabled or no OpenAI client
                     raise
+        wrapper._cached_source = source
         return wrapper
     
-    def _handle_error(self, error: Exception, func: Callable, args: tuple, kwargs: dict):
+    def install_global_hook(self):
+        """
+        Analyze uncaught exceptions from sys.excepthook instead of per-function wrappers.
+        
+        Functions decorated after this call are returned unchanged, so they carry
+        no overhead until an exception actually reaches the top level. Uncaught
+        exceptions in threads and unraisable exceptions are handled as well.
+        """
+        if self._global_hook_installed:
+            return
+        self._global_hook_installed = True
+        
+        self._previous_excepthook = sys.excepthook
+        sys.excepthook = self._excepthook
+        
+        # threading.excepthook and sys.unraisablehook were added in Python 3.8
+        if hasattr(threading, "excepthook"):
+            self._previous_threading_excepthook = threading.excepthook
+            threading.excepthook = self._threading_excepthook
+        if hasattr(sys, "unraisablehook"):
+            self._previous_unraisablehook = sys.unraisablehook
+            sys.unraisablehook = self._unraisablehook
+    
+    def _excepthook(self, exc_type: type, exc: BaseException, tb: Optional[types.TracebackType]):
+        """Print the traceback as usual, then analyze the exception."""
+        self._previous_excepthook(exc_type, exc, tb)
+        self._analyze_uncaught(exc, tb)
+    
+    def _threading_excepthook(self, args: Any):
+        """Handle an exception that escaped a thread's run method."""
+        self._previous_threading_excepthook(args)
+        self._analyze_uncaught(args.exc_value, args.exc_traceback)
+    
+    def _unraisablehook(self, unraisable: Any):
+        """Handle an exception that Python could not raise, e.g. in __del__."""
+        self._previous_unraisablehook(unraisable)
+        self._analyze_uncaught(unraisable.exc_value, unraisable.exc_traceback)
+    
+    def _analyze_uncaught(self, exc: Optional[BaseException], tb: Optional[types.TracebackType]):
+        """Rebuild the failing function's context from the traceback and analyze it."""
+        if not isinstance(exc, Exception) or tb is None or not (self.debug_mode and self.client):
+            return
+        
+        # Blame the user's code rather than the library frame that raised
+        frames = []
+        while tb is not None:
+            frames.append(tb.tb_frame)
+            tb = tb.tb_next
+        frame = frames[self._user_frame_index([f.f_code.co_filename for f in frames])]
+        
+        try:
+            try:
+                source = inspect.getsource(frame.f_code)
+            except (OSError, TypeError):
+                source = SOURCE_UNAVAILABLE
+            func = types.SimpleNamespace(__name__=frame.f_code.co_name, _cached_source=source)
+            
+            # An argument may have been deleted with del before the exception
+            arg_info = inspect.getargvalues(frame)
+            args = tuple(arg_info.locals.get(name) for name in arg_info.args)
+            
+            self._handle_error(exc, func, args, {})
+        except Exception:
+            # The analysis failed; the traceback has already been printed
+            pass
+    
+    def _handle_error(self, error: Exception, func: Callable, args: tuple, kwargs: dict,
+                      exc_info: Optional[tuple] = None):
         """Handle an error by analyzing it with GPT-4 and suggesting fixes."""
-        console.print("\n[red]🚨 Error occurred![/red]")
-        console.print(f"[red]Function: {func.__name__}[/red]")
-        console.print(f"[red]Error: {type(error).__name__}: {str(error)}[/red]")
+        from rich.prompt import Confirm
         
-        # Get the full traceback
-        tb = traceback.format_exc()
+        # Without a client there is nothing to report back, so skip building any context
+        if not self.client:
+            raise error
+        
+        if self.buffered_mode:
+            self._queue_error(error, func, args, kwargs, exc_info)
+            return None
         
-        # Get function source code if available
+        with self._handle_lock:
+            console = _get_console()
+            console.print("\n[red]🚨 Error occurred![/red]")
+            console.print(f"[red]Function: {func.__name__}[/red]")
+            console.print(f"[red]Error: {type(error).__name__}: {str(error)}[/red]")
+            
+            tb, source = self._format_error(error, func, exc_info)
+            
+            # Common errors with an obvious cause are answered locally
+            title = "🔍 Local Analysis"
+            analysis = self._local_analysis(error, func, args, kwargs)
+            if not analysis:
+                title = "🔍 GPT-4 Analysis"
+            
+                # Reuse a previous analysis of the same error when there is one
+                cache_key = self._cache_key(type(error).__name__, tb)
+                analysis = self._get_cached_analysis(cache_key)
+                if analysis:
+                    console.print("[dim]Using cached analysis[/dim]")
+                else:
+                    analysis = self._request_analysis(error, func, args, kwargs, tb, source)
+                    if self._is_cacheable(analysis):
+                        self._store_analysis(cache_key, analysis)
+            
+            if analysis:
+                self._display_analysis(analysis, title)
+            
+                # Ask user if they want to apply the suggested fix
+                if Confirm.ask("Would you like to apply the suggested fix?", default=False):
+                    self._apply_fix(analysis, func, args, kwargs)
+            else:
+                console.print("[yellow]Could not analyze error with GPT-4. Re-raising original exception.[/yellow]")
+                raise error
+    
+    def _local_analysis(self, error: Exception, func: Callable, args: tuple,
+                        kwargs: dict) -> Optional[Dict[str, Any]]:
+        """Return a high-confidence analysis from the local rules, if one matches."""
         try:
-            source = inspect.getsource(func)
-        except (OSError, TypeError):
-            source = "Source code not available"
+            analysis = self._local.analyze(error, func, args, kwargs)
+        except Exception:
+            # A broken rule must never hide the original error
+            return None
+        if analysis and analysis.get("confidence") == "high":
+            return analysis
+        return None
+    
+    def _format_error(self, error: Exception, func: Callable,
+                      exc_info: Optional[tuple] = None) -> Tuple[str, str]:
+        """Return the formatted traceback and the source code to show GPT-4."""
+        # Walk the traceback once and derive both the traceback text and the source from it
+        if exc_info is None:
+            exc_info = (type(error), error, error.__traceback__)
+        tbe = traceback.TracebackException(*exc_info, capture_locals=self.capture_locals)
+        tb = "".join(tbe.format())
         
-        # Prepare context for GPT-4
+        # Get function source code, preferring the copy cached at decoration time
+        source = getattr(func, "_cached_source", None)
+        if not source or source == SOURCE_UNAVAILABLE:
+            source = self._source_from_traceback(tbe)
+        return tb, source
+    
+    def _queue_error(self, error: Exception, func: Callable, args: tuple, kwargs: dict,
+                     exc_info: Optional[tuple] = None):
+        """Record an error for the next batched analysis instead of analyzing it now."""
+        tb, source = self._format_error(error, func, exc_info)
         context = self._prepare_context(error, func, args, kwargs, tb, source)
+        local = self._local_analysis(error, func, args, kwargs)
         
-        # Analyze with GPT-4
-        analysis = self._analyze_with_gpt4(context)
+        # Decorated functions may fail on several threads at once
+        with self._pending_lock:
+            self._pending.append((context, local))
+            if not self._flush_registered:
+                self._flush_registered = True
+                atexit.register(self.flush)
         
-        if analysis:
-            self._display_analysis(analysis)
-            
-            # Ask user if they want to apply the suggested fix
-            if Confirm.ask("Would you like to apply the suggested fix?", default=False):
-                self._apply_fix(analysis, func, args, kwargs)
-        else:
-            console.print("[yellow]Could not analyze error with GPT-4. Re-raising original exception.[/yellow]")
-            raise error
+        _get_console().print(
+            f"[dim]Queued {type(error).__name__} in {func.__name__} for batched analysis[/dim]"
+        )
+    
+    def flush(self):
+        """
+        Analyze all queued errors with batched GPT-4 requests and display the results.
+        
+        Runs automatically at exit once an error has been queued.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        
+        console = _get_console()
+        console.print(f"\n[bold blue]🔍 Analyzing {len(pending)} queued error(s)[/bold blue]")
+        
+        analyses: List[Optional[Dict[str, Any]]] = []
+        misses = []
+        for context, local in pending:
+            if local:
+                analyses.append(local)
+                continue
+            cache_key = self._cache_key(context["error_type"], context["traceback"])
+            analysis = self._get_cached_analysis(cache_key)
+            analyses.append(analysis)
+            if not analysis:
+                misses.append((len(analyses) - 1, cache_key, context))
+        
+        if misses and self.client:
+            # Split large batches so every answer fits in its request's token budget
+            for start in range(0, len(misses), BATCH_SIZE):
+                chunk = misses[start:start + BATCH_SIZE]
+                batch = self._analyze_batch([context for _, _, context in chunk])
+                for (index, cache_key, _), analysis in zip(chunk, batch):
+                    if isinstance(analysis, dict):
+                        analyses[index] = analysis
+                        if self._is_cacheable(analysis):
+                            self._store_analysis(cache_key, analysis)
+        
+        for (context, local), analysis in zip(pending, analyses):
+            console.print(f"\n[red]🚨 {context['function_name']}: "
+                          f"{context['error_type']}: {context['error_message']}[/red]")
+            if analysis:
+                try:
+                    self._display_analysis(analysis, "🔍 Local Analysis" if local else "🔍 GPT-4 Analysis")
+                except Exception as e:
+                    # One malformed answer must not hide the remaining ones
+                    console.print(f"[red]Could not display analysis: {e}[/red]")
+            else:
+                console.print("[yellow]Could not analyze error with GPT-4. Original traceback:[/yellow]")
+                console.print(context["traceback"], markup=False, highlight=False)
+    
+    def _analyze_batch(self, contexts: List[Dict[str, Any]]) -> List[Any]:
+        """Analyze several errors with one GPT-4 request, returning one answer per error."""
+        errors = [
+            {key: value for key, value in context.items()
+             if key not in ("python_version", "working_directory")}
+            for context in contexts
+        ]
+        prompt = "".join((
+            _BATCH_PROMPT_PREFIX,
+            "\nErrors (a JSON array with one object per error):\n", json.dumps(errors, indent=2),
+            "\n\nEnvironment:",
+            "\n- Python Version: ", sys.version,
+            "\n- Working Directory: ", os.getcwd(), "\n",
+        ))
+        
+        try:
+            response = self.client.chat.completions.create(
+                model="gpt-4",
+                messages=self._analysis_messages(prompt),
+                temperature=0.1,
+                max_tokens=BATCH_TOKENS_PER_ERROR * len(contexts),
+                user=self._prompt_cache_user
+            )
+            return _json_loads(response.choices[0].message.content)["analyses"]
+        except Exception as e:
+            _get_console().print(f"[red]Error calling GPT-4: {e}[/red]")
+            return []
+    
+    def _request_analysis(self, error: Exception, func: Callable, args: tuple,
+                          kwargs: dict, tb: str, source: str) -> Optional[Dict[str, Any]]:
+        """Ask GPT-4 for an analysis of the error with the full context."""
+        context = self._prepare_context(error, func, args, kwargs, tb, source)
+        return self._analyze_with_gpt4(self._create_analysis_prompt(context))
+    
+    def _source_from_traceback(self, tbe: traceback.TracebackException) -> str:
+        """Return the lines around the innermost user frame of the traceback, from the linecache."""
+        if not tbe.stack:
+            return SOURCE_UNAVAILABLE
+        
+        frame = tbe.stack[self._user_frame_index([f.filename for f in tbe.stack])]
+        lines = linecache.getlines(frame.filename)
+        if not lines or not frame.lineno:
+            return SOURCE_UNAVAILABLE
+        
+        start = max(frame.lineno - 1 - SOURCE_CONTEXT_LINES, 0)
+        return "".join(lines[start:frame.lineno + SOURCE_CONTEXT_LINES])
+    
+    def _user_frame_index(self, filenames: List[str]) -> int:
+        """
+        Pick the frame most likely to contain the bug, given each frame's filename.
+        
+        Prefers the innermost frame in the running script, then the innermost
+        frame outside this module, the standard library and site-packages, and
+        falls back to the frame that raised.
+        """
+        script = self.script_path or getattr(sys.modules.get("__main__"), "__file__", None)
+        script = os.path.realpath(script) if script else None
+        if script == os.path.realpath(__file__):
+            # Run as `python self_debug_cli.py` without a script path recorded
+            script = None
+        
+        fallback = None
+        for index in range(len(filenames) - 1, -1, -1):
+            if os.path.realpath(filenames[index]) == script:
+                return index
+            if fallback is None and not _is_library_file(filenames[index]):
+                fallback = index
+        return len(filenames) - 1 if fallback is None else fallback
+    
+    def _cache_key(self, error_type: str, traceback_str: str) -> str:
+        """Build a cache key that ignores file paths, line numbers and memory addresses."""
+        normalized_tb = _HEX_RE.sub("", _PATH_NORM_RE.sub("", traceback_str))
+        return hashlib.blake2b(f"{error_type}|{normalized_tb}".encode(), digest_size=16).hexdigest()
+    
+    def _load_cache(self) -> Dict[str, Dict[str, Any]]:
+        """Load the on-disk analysis cache the first time it is needed; callers hold _cache_lock."""
+        if self._cache is None:
+            try:
+                with open(CACHE_PATH, 'rb') as f:
+                    self._cache = _json_loads(f.read())
+            except (OSError, ValueError):
+                self._cache = {}
+        return self._cache
+    
+    def _get_cached_analysis(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a previously stored analysis for this key, if caching is enabled."""
+        if not self.use_cache:
+            return None
+        with self._cache_lock:
+            return self._load_cache().get(key)
+    
+    def _is_cacheable(self, analysis: Any) -> bool:
+        """Only keep answers GPT-4 returned as JSON and was reasonably sure of."""
+        return isinstance(analysis, dict) and analysis.get("confidence") in ("high", "medium")
+    
+    def _store_analysis(self, key: str, analysis: Dict[str, Any]):
+        """Store an analysis and atomically rewrite the cache file."""
+        if not self.use_cache:
+            return
+        # Errors from several threads may be stored at once; dump a snapshot so
+        # the dict cannot change size while json.dump iterates over it
+        with self._cache_lock:
+            cache = self._load_cache()
+            cache[key] = analysis
+            snapshot = dict(cache)
+            try:
+                CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=CACHE_PATH.parent,
+                                                 suffix='.tmp', delete=False) as f:
+                    json.dump(snapshot, f)
+                os.replace(f.name, CACHE_PATH)
+            except (OSError, TypeError, ValueError) as e:
+                _get_console().print(f"[yellow]Warning: Could not write analysis cache: {e}[/yellow]")
     
     def _prepare_context(self, error: Exception, func: Callable, args: tuple, 
                         kwargs: dict, traceback_str: str, source: str) -> Dict[str, Any]:
@@ -120,87 +801,152 @@ class SelfDebugCLI:
             "working_directory": os.getcwd()
         }
     
-    def _analyze_with_gpt4(self, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def _analyze_with_gpt4(self, prompt: str) -> Optional[Dict[str, Any]]:
         """Analyze the error using GPT-4."""
         try:
-            prompt = self._create_analysis_prompt(context)
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a Python debugging expert. Analyze the error and provide clear explanations and fixes."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.1,
-                max_tokens=2000
-            )
+            messages = self._analysis_messages(prompt)
             
-            content = response.choices[0].message.content
-            
-            # Try to parse as JSON, fallback to text
             try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                return {
-                    "explanation": content,
-                    "suggested_fix": "Manual review required",
-                    "confidence": "medium"
-                }
+                content = self._stream_completion(messages)
+            except Exception:
+                # Fall back to a regular blocking request if streaming fails
+                response = self.client.chat.completions.create(
+                    model="gpt-4",
+                    messages=messages,
+                    temperature=0.1,
+                    max_tokens=2000,
+                    user=self._prompt_cache_user
+                )
+                content = response.choices[0].message.content
+            
+            return self._parse_analysis(content)
                 
         except Exception as e:
-            console.print(f"[red]Error calling GPT-4: {e}[/red]")
+            _get_console().print(f"[red]Error calling GPT-4: {e}[/red]")
             return None
     
+    def _parse_analysis(self, content: str) -> Dict[str, Any]:
+        """Parse GPT-4's answer as JSON, falling back to the raw text."""
+        # The fallback is marked low confidence so it is never cached
+        try:
+            return _json_loads(content)
+        except json.JSONDecodeError:
+            return {
+                "explanation": content,
+                "suggested_fix": "Manual review required",
+                "confidence": "low"
+            }
+    
+    def _analysis_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Build the chat messages for an analysis prompt."""
+        return [
+            {
+                "role": "system",
+                "content": "You are a Python debugging expert. Analyze the error and provide clear explanations and fixes."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    
+    def _stream_completion(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Stream a GPT-4 completion, rendering tokens as they arrive.
+        
+        Stops reading as soon as the first top-level JSON object is closed and
+        returns just that object; otherwise returns the full response text.
+        """
+        from rich.live import Live
+        from rich.text import Text
+        
+        response = self.client.chat.completions.create(
+            model="gpt-4",
+            messages=messages,
+            temperature=0.1,
+            max_tokens=2000,
+            user=self._prompt_cache_user,
+            stream=True
+        )
+        
+        buf = ""
+        first_brace = -1
+        depth = 0
+        in_string = False
+        escaped = False
+        streamed = Text(style="dim")
+        
+        try:
+            with Live(streamed, console=_get_console(), transient=True):
+                for chunk in response:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    
+                    start = len(buf)
+                    buf += delta
+                    streamed.append(delta)
+                    
+                    # Track brace depth outside of JSON strings
+                    for i in range(start, len(buf)):
+                        char = buf[i]
+                        if in_string:
+                            if escaped:
+                                escaped = False
+                            elif char == "\\":
+                                escaped = True
+                            elif char == '"':
+                                in_string = False
+                        elif char == '"' and depth:
+                            in_string = True
+                        elif char == "{":
+                            if depth == 0:
+                                first_brace = i
+                            depth += 1
+                        elif char == "}" and depth:
+                            depth -= 1
+                            if depth == 0:
+                                return buf[first_brace:i + 1]
+        finally:
+            close = getattr(response, "close", None)
+            if close:
+                close()
+        
+        return buf
+    
     def _create_analysis_prompt(self, context: Dict[str, Any]) -> str:
         """Create the prompt for GPT-4 analysis."""
-        return f"""
-Please analyze this Python error and provide a detailed explanation and fix.
-
-Error Information:
-- Error Type: {context['error_type']}
-- Error Message: {context['error_message']}
-- Function: {context['function_name']}
-- Arguments: {context['function_args']}
-- Keyword Arguments: {context['function_kwargs']}
-
-Function Source Code:
-```python
-{context['function_source']}
-```
-
-Full Traceback:
-```
-{context['traceback']}
-```
-
-Environment:
-- Python Version: {context['python_version']}
-- Working Directory: {context['working_directory']}
-
-Please provide your analysis in the following JSON format:
-{{
-    "explanation": "Clear explanation of what went wrong",
-    "root_cause": "The underlying cause of the error",
-    "suggested_fix": "Specific code fix or workaround",
-    "confidence": "high/medium/low",
-    "additional_notes": "Any additional helpful information"
-}}
-"""
+        return "".join((
+            _PROMPT_PREFIX,
+            "\nError Information:",
+            "\n- Error Type: ", context["error_type"],
+            "\n- Error Message: ", context["error_message"],
+            "\n- Function: ", context["function_name"],
+            "\n- Arguments: ", context["function_args"],
+            "\n- Keyword Arguments: ", context["function_kwargs"],
+            "\n\nFunction Source Code:\n```python\n", context["function_source"], "\n```\n",
+            "\nFull Traceback:\n```\n", context["traceback"], "\n```\n",
+            "\nEnvironment:",
+            "\n- Python Version: ", context["python_version"],
+            "\n- Working Directory: ", context["working_directory"], "\n",
+        ))
     
-    def _display_analysis(self, analysis: Dict[str, Any]):
+    def _display_analysis(self, analysis: Dict[str, Any], title: str = "🔍 GPT-4 Analysis"):
         """Display the GPT-4 analysis in a formatted way."""
-        console.print("\n[bold blue]🔍 GPT-4 Analysis[/bold blue]")
+        from rich.markup import escape
+        from rich.panel import Panel
+        
+        console = _get_console()
+        console.print(f"\n[bold blue]{title}[/bold blue]")
+        
+        # Analysis text is plain text, so brackets such as lst[index] must not be read as markup
         
         # Explanation
         if "explanation" in analysis:
             console.print(Panel(
-                analysis["explanation"],
+                escape(str(analysis["explanation"])),
                 title="[bold]Explanation[/bold]",
                 border_style="blue"
             ))
@@ -208,7 +954,7 @@ Please provide your analysis in the following JSON format:
         # Root cause
         if "root_cause" in analysis:
             console.print(Panel(
-                analysis["root_cause"],
+                escape(str(analysis["root_cause"])),
                 title="[bold]Root Cause[/bold]",
                 border_style="yellow"
             ))
@@ -216,7 +962,7 @@ Please provide your analysis in the following JSON format:
         # Suggested fix
         if "suggested_fix" in analysis:
             console.print(Panel(
-                Syntax(analysis["suggested_fix"], "python", theme="monokai"),
+                _highlight(str(analysis["suggested_fix"])),
                 title="[bold]Suggested Fix[/bold]",
                 border_style="green"
             ))
@@ -234,13 +980,14 @@ Please provide your analysis in the following JSON format:
         # Additional notes
         if "additional_notes" in analysis:
             console.print(Panel(
-                analysis["additional_notes"],
+                escape(str(analysis["additional_notes"])),
                 title="[bold]Additional Notes[/bold]",
                 border_style="cyan"
             ))
     
     def _apply_fix(self, analysis: Dict[str, Any], func: Callable, args: tuple, kwargs: dict):
         """Apply the suggested fix (placeholder for now)."""
+        console = _get_console()
         console.print("[yellow]⚠️  Auto-fix feature is not yet implemented.[/yellow]")
         console.print("[yellow]Please manually apply the suggested fix from the analysis above.[/yellow]")
     
@@ -267,45 +1014,47 @@ def self_debug(func: Callable) -> Callable:
     return debug_cli.debug_function(func)
 
 
-@click.command()
-@click.option('--api-key', envvar='OPENAI_API_KEY', help='OpenAI API key')
-@click.option('--debug/--no-debug', default=True, help='Enable/disable self-debugging')
-@click.argument('script', type=click.Path(exists=True))
-@click.argument('args', nargs=-1)
-def main(api_key: str, debug: bool, script: str, args: tuple):
+def _run_script(api_key: str, debug: bool, no_cache: bool, batch_errors: bool,
+                script: str, args: tuple):
     """Run a Python script with self-debugging enabled."""
     # Update debug mode
     debug_cli.debug_mode = debug
+    debug_cli.use_cache = not no_cache
+    debug_cli.buffered_mode = batch_errors
     
     # Set API key if provided
     if api_key:
         debug_cli.api_key = api_key
         if OPENAI_AVAILABLE:
+            from openai import OpenAI
             debug_cli.client = OpenAI(api_key=api_key)
     
     # Load and run the script
     script_path = Path(script)
     
-    # Read the script content
-    with open(script_path, 'r') as f:
-        script_content = f.read()
-    
-    # Create a namespace for the script
-    script_globals = {
-        '__name__': '__main__',
-        '__file__': str(script_path),
+    # Names made available to the script without importing them
+    init_globals = {
         'self_debug': self_debug,
         'debug_cli': debug_cli
     }
     
     # Add command line arguments
-    script_globals['sys.argv'] = [script] + list(args)
+    sys.argv = [str(script_path), *args]
+    debug_cli.script_path = str(script_path.resolve())
     
-    console.print(f"[bold green]🚀 Running {script} with self-debugging enabled[/bold green]")
+    # Like `python script.py`, let the script import modules that sit next to it.
+    # run_path already executes it as a real __main__ module, not a bare dict.
+    sys.path.insert(0, str(script_path.resolve().parent))
+    
+    _get_console().print(f"[bold green]🚀 Running {script} with self-debugging enabled[/bold green]")
+    
+    # When run as `python self_debug_cli.py` this module is __main__; make the
+    # script's `import self_debug_cli` return it so the options above apply
+    sys.modules.setdefault("self_debug_cli", sys.modules[__name__])
     
     try:
         # Execute the script
-        exec(script_content, script_globals)
+        runpy.run_path(str(script_path), init_globals=init_globals, run_name='__main__')
     except Exception as e:
         if debug and debug_cli.client:
             # Create a dummy function to wrap the error
@@ -317,5 +1066,24 @@ def main(api_key: str, debug: bool, script: str, args: tuple):
             raise
 
 
+def main():
+    """Command line entry point; click is only imported when the CLI is used."""
+    import click
+    
+    @click.command()
+    @click.option('--api-key', envvar='OPENAI_API_KEY', help='OpenAI API key')
+    @click.option('--debug/--no-debug', default=True, help='Enable/disable self-debugging')
+    @click.option('--no-cache', is_flag=True, help='Always ask GPT-4 instead of reusing cached analyses')
+    @click.option('--batch-errors/--no-batch-errors', default=False,
+                  help='Analyze errors in batched GPT-4 requests when the script exits')
+    @click.argument('script', type=click.Path(exists=True))
+    @click.argument('args', nargs=-1)
+    def cli(api_key: str, debug: bool, no_cache: bool, batch_errors: bool, script: str, args: tuple):
+        """Run a Python script with self-debugging enabled."""
+        _run_script(api_key, debug, no_cache, batch_errors, script, args)
+    
+    cli()
+
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file